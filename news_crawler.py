@@ -1,40 +1,180 @@
 import os
 import time
-import json
+import orjson
 import re
-import requests
+import random
+import hashlib
+import asyncio
+import httpx
+import tiktoken
 import datetime
-from urllib.parse import urljoin
-from openai import OpenAI
+import functools
+from zoneinfo import ZoneInfo
+from urllib.parse import urljoin, urlsplit, urlunsplit
+from openai import AsyncOpenAI, BadRequestError, RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 
 # ================= 全局配置 =================
+# 以下配置均可通过同名环境变量覆盖，便于在 CI 或本地调试时调整而无需修改代码
+
 # 1. 统一使用的 AI 模型
-AI_MODEL = "stepfun/step-3.5-flash:free"  
+AI_MODEL = os.environ.get("AI_MODEL", "stepfun/step-3.5-flash:free")
 
-# 2. 目标数据源
-SOURCES = [
+# 2. 目标数据源（环境变量中以英文逗号分隔）
+SOURCES = [s.strip() for s in os.environ.get("SOURCES", "").split(",") if s.strip()] or [
     "https://www.ithome.com",
     "https://www.mydrivers.com"
 ]
 
-# 3. 输出文件路径
-OUTPUT_DIR = "data"
-OUTPUT_FILE = os.path.join(OUTPUT_DIR, "daily_tech_news.json")
+# 3. 每次提取的热点新闻条数
+NEWS_LIMIT = 8
+# 本地解析到的新闻少于该数量时才请求 AI 提取；介于两者之间时直接使用本地结果，省去一次 AI 调用
+LOCAL_NEWS_MIN = 5
+
+# 4. 标题中包含以下关键词的链接视为【硬件科技产品】新闻，用于本地筛选
+HARDWARE_KEYWORDS = (
+    "芯片", "处理器", "CPU", "GPU", "显卡", "内存", "SSD", "硬盘", "主板",
+    "手机", "折叠屏", "平板", "电脑", "笔记本", "显示器", "屏幕", "耳机", "手表", "相机",
+    "iPhone", "iPad", "Mac", "Pixel", "骁龙", "天玑", "麒麟", "高通", "联发科",
+    "Intel", "英特尔", "酷睿", "AMD", "锐龙", "NVIDIA", "英伟达", "RTX",
+    "苹果", "华为", "小米", "荣耀", "三星", "OPPO", "vivo", "一加", "realme",
+)
+
+# 5. 输出文件路径
+OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "data")
+OUTPUT_FILE = os.path.join(OUTPUT_DIR, os.environ.get("OUTPUT_FILENAME", "daily_tech_news.json"))
+
+# 6. 详情页并发抓取上限，避免同时请求过多被 Jina 封锁；单次请求超时时间（秒）
+JINA_CONCURRENCY = int(os.environ.get("JINA_CONCURRENCY", 5))
+JINA_TIMEOUT = int(os.environ.get("JINA_TIMEOUT", 40))
+
+# 7. AI 请求并发上限，避免超出 OpenRouter 免费额度的并发限制
+AI_CONCURRENCY = int(os.environ.get("AI_CONCURRENCY", 3))
+
+# 8. 发送给 AI 的内容 token 预算（为提示词和回复预留空间，适配 16K 上下文的免费模型）
+MODEL_CONTEXT_TOKENS = int(os.environ.get("MODEL_CONTEXT_TOKENS", 16384))
+# 提示词模板、消息格式等固定开销的预留
+PROMPT_RESERVE_TOKENS = 500
+HOME_TOKEN_BUDGET = int(os.environ.get("HOME_TOKEN_BUDGET", 12000))
+ARTICLE_TOKEN_BUDGET = int(os.environ.get("ARTICLE_TOKEN_BUDGET", 6000))
+# 批量提取详情时每篇文章至少保留的输入 token 数，决定单批最多能放几篇
+BATCH_ARTICLE_MIN_TOKENS = int(os.environ.get("BATCH_ARTICLE_MIN_TOKENS", 3000))
+
+# 9. AI 单次回复的最大 token 数，限制模型输出多余的说明文字
+LIST_MAX_TOKENS = 800
+DETAIL_MAX_TOKENS = 700
+
+# 单次批量请求最多包含的文章数：每篇的输入预算加回复上限，合计不得超出模型上下文（默认 4 篇）
+BATCH_MAX_ARTICLES = max(1, (MODEL_CONTEXT_TOKENS - PROMPT_RESERVE_TOKENS) // (BATCH_ARTICLE_MIN_TOKENS + DETAIL_MAX_TOKENS))
+
+# 10. Jina 请求的重试策略：仅在以下状态码或网络异常时重试，等待时间按 backoff 指数增长并带随机抖动
+JINA_MAX_RETRIES = 5
+JINA_BACKOFF_FACTOR = 2
+JINA_BACKOFF_MAX = 60
+JINA_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# 11. Jina 响应的本地缓存目录与有效期（秒），重复运行时命中缓存可跳过网络请求
+# 主页更新频繁，缓存时间较短；文章内容基本不变，可缓存更久；设置 FORCE_REFRESH=1 可跳过缓存
+CACHE_DIR = os.path.join(".cache", "jina")
+HOME_CACHE_TTL = int(os.environ.get("HOME_CACHE_TTL", 30 * 60))
+ARTICLE_CACHE_TTL = int(os.environ.get("ARTICLE_CACHE_TTL", 24 * 3600))
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 100))
+FORCE_REFRESH = os.environ.get("FORCE_REFRESH", "").lower() in ("1", "true", "yes")
 
 # ===========================================
 
+JINA_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Referer": "https://www.google.com/",
+    # Markdown 压缩率很高，显式请求压缩可明显减少传输字节数（br 解码依赖 httpx[brotli]）
+    "Accept-Encoding": "gzip, deflate, br",
+    "X-Return-Format": "markdown"
+}
+
+# 提示词模板：静态部分在导入时构建一次，调用时只填入变量。
+# 详情提取的固定指令放在 system 消息中，多次请求共享相同前缀，便于服务端做提示词缓存
+HOT_NEWS_PROMPT_TMPL = """
+    今天是北京时间：{date}。
+    
+    请分析以下网页内容，严格筛选出【今天 ({date})】发布的、最热门的 {limit} 条【硬件科技产品】新闻（手机、电脑、芯片、数码等）。
+    
+    如果不确定日期，请优先选择列表中最靠前的新闻。
+    
+    请严格返回 JSON 格式，不要包含任何 markdown 标记或额外文字，seg 为该新闻所在内容段的编号：
+    {{"items": [
+        {{"title": "新闻标题", "url": "链接地址", "seg": 1}}
+    ]}}
+    
+    内容来源（每个 <<<SEG>>> 标记开始一个网站的内容）：
+    {context}
+    """
+
+DETAIL_SYSTEM_PROMPT = """
+    请阅读用户提供的这篇科技新闻，提取核心内容总结（300字以内）。
+    
+    请严格返回 JSON 格式：
+    {
+        "content": "这里是总结..."
+    }
+    """
+
+BATCH_DETAIL_SYSTEM_PROMPT = """
+    用户会提供多篇科技新闻，每篇以 ===ARTICLE_编号=== 开头。
+    请逐篇阅读，提取核心内容总结（300字以内）。
+    
+    请严格返回 JSON 格式，items 中每篇一项，idx 为文章编号：
+    {"items": [
+        {"idx": 0, "content": "这里是总结..."}
+    ]}
+    """
+
+# Jina 返回的 Markdown 中的文字链接 [标题](URL)，排除图片 ![alt](URL)
+LINK_RE = re.compile(r'(?<!!)\[([^\[\]]{5,120})\]\((https?://[^\s)]+)\)')
+# 已知来源的文章页路径格式（按主域名），用于排除主页上的广告、商城、标签/分类页等链接；
+# 未列出的来源只校验域名
+ARTICLE_PATH_RES = {
+    "ithome.com": re.compile(r'^/0/\d+/\d+\.htm$'),
+    "mydrivers.com": re.compile(r'^/1/\d+/\d+\.htm$'),
+}
+# Jina 返回的 Markdown 中的图片 ![alt](URL)
+IMG_RE = re.compile(r'!\[[^\]]*\]\((https?://[^\s)]+)\)')
+# 压缩 Markdown 用：多余空行、行尾空白、只有一个链接（导航/相关推荐）或只有一张图片的行
+BLANK_LINES_RE = re.compile(r'\n{3,}')
+TRAILING_SPACE_RE = re.compile(r'[ \t]+$', re.MULTILINE)
+LINK_LINE_RE = re.compile(r'^[ \t]*(?:[-*+][ \t]*)?\[[^\[\]]*\]\([^)]*\)[ \t]*$', re.MULTILINE)
+IMAGE_LINE_RE = re.compile(r'^[ \t]*(?:[-*+][ \t]*)?\[?!\[[^\]]*\]\([^)]*\)(?:\]\([^)]*\))?[ \t]*$', re.MULTILINE)
+
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
 
-client = OpenAI(
+BEIJING_TZ = ZoneInfo("Asia/Shanghai")
+
+# tokenizer 不可用时按字符估算截断：中文常见 1~2 个 token 一个字，取保守比例避免超出上下文
+FALLBACK_CHARS_PER_TOKEN = 0.6
+# 多段内容合并为一条消息时每段的模板
+SEGMENT_TMPL = "<<<SEG {i}/{n}>>>\n{chunk}"
+ARTICLE_TMPL = "\n\n===ARTICLE_{i}===\n{chunk}"
+# 截断时按优先级在这些 Markdown 边界处断开，避免切断标题、链接或句子
+SPLIT_SEPARATORS = ("\n## ", "\n### ", "\n\n", "\n", "。", ". ", " ")
+
+client = AsyncOpenAI(
     base_url="https://openrouter.ai/api/v1",
     api_key=OPENROUTER_API_KEY,
 )
 
+# 所有 AI 请求共用的并发限制
+ai_semaphore = asyncio.Semaphore(AI_CONCURRENCY)
+
+# 本次运行中已发起的 Jina 请求（URL -> Task），相同 URL 共用同一个请求
+inflight_fetches = {}
+
+# 当前模型是否支持 JSON 模式（response_format），首次被拒绝后不再尝试
+json_mode_supported = True
+
+@functools.lru_cache(maxsize=1)
 def get_beijing_date():
-    """获取北京时间今天的日期字符串 (YYYY-MM-DD)"""
-    utc_now = datetime.datetime.utcnow()
-    beijing_now = utc_now + datetime.timedelta(hours=8)
-    return beijing_now.strftime("%Y-%m-%d")
+    """获取北京时间今天的日期字符串 (YYYY-MM-DD)，单次运行内只计算一次"""
+    return datetime.datetime.now(BEIJING_TZ).strftime("%Y-%m-%d")
 
 def ensure_dir():
     """确保输出目录存在"""
@@ -44,212 +184,621 @@ def ensure_dir():
 def save_json_file(data):
     """
     保存数据到文件。
-    使用 'w' 模式，这意味着每次写入都会清空旧内容，只保存最新一次的结果。
+    先写入临时文件再用 os.replace 原子替换，每次写入都会覆盖旧内容，只保存最新一次的结果；
+    即使写入过程中进程被终止，原文件也不会被截断。
     """
     ensure_dir()
+    tmp_file = OUTPUT_FILE + ".tmp"
     try:
-        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        # orjson 直接输出 UTF-8 字节，中文无需转义
+        with open(tmp_file, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+            # 确保内容已落盘再替换，避免断电后得到空文件
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, OUTPUT_FILE)
         print(f"✅ 数据已覆盖保存至: {OUTPUT_FILE}")
     except Exception as e:
         print(f"❌ 保存文件失败: {e}")
+        # 清理写了一半的临时文件，原文件保持不变；清理失败不应掩盖原始错误
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
+def get_cache_path(url):
+    """根据 URL 计算缓存文件路径"""
+    key = hashlib.blake2b(url.encode("utf-8"), digest_size=16).hexdigest()
+    return os.path.join(CACHE_DIR, f"{key}.md")
 
-def fetch_jina_content(url):
+def read_cache(url):
+    """读取未过期的缓存内容，未命中或设置了 FORCE_REFRESH 时返回 None"""
+    if FORCE_REFRESH:
+        return None
+    path = get_cache_path(url)
+    ttl = HOME_CACHE_TTL if url in SOURCES else ARTICLE_CACHE_TTL
+    try:
+        mtime = os.path.getmtime(path)
+        if time.time() - mtime > ttl:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        # 只更新访问时间（用于淘汰），保留修改时间（用于判断过期）
+        os.utime(path, (time.time(), mtime))
+        return text
+    except OSError:
+        return None
+
+def evict_cache():
+    """缓存条目超过 CACHE_MAX_ENTRIES 时，按访问时间删除最久未使用的文件"""
+    entries = [e for e in os.scandir(CACHE_DIR) if e.name.endswith(".md")]
+    if len(entries) <= CACHE_MAX_ENTRIES:
+        return
+    entries.sort(key=lambda e: e.stat().st_atime)
+    for entry in entries[:len(entries) - CACHE_MAX_ENTRIES]:
+        os.remove(entry.path)
+
+def write_cache(url, text):
+    """原子写入缓存并淘汰多余条目，失败时不影响主流程"""
+    path = get_cache_path(url)
+    tmp_path = path + ".tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        evict_cache()
+    except OSError as e:
+        print(f"   ⚠️ 写入缓存失败: {e}")
+
+def create_session():
+    """
+    创建整个运行过程共用的 HTTP 会话。
+    启用 HTTP/2 后所有并发请求复用同一条到 r.jina.ai 的连接，无需重复 TCP/TLS 握手。
+    """
+    limits = httpx.Limits(max_connections=10, max_keepalive_connections=10)
+    # 设置较长的超时时间；httpx 默认不跟随重定向，需显式开启
+    return httpx.AsyncClient(
+        http2=True, limits=limits, timeout=JINA_TIMEOUT, headers=JINA_HEADERS, follow_redirects=True
+    )
+
+class RetryableFetchError(Exception):
+    """Jina 返回可重试的状态码，或内容过短（可能是空页面或验证码）"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def get_backoff_delay(attempt, retry_after=None):
+    """
+    计算第 attempt 次重试前的等待秒数。
+    服务端给出 Retry-After 时以其为准，否则使用带随机抖动的指数退避。
+    """
+    if retry_after and retry_after.isdigit():
+        return min(int(retry_after), JINA_BACKOFF_MAX)
+    return random.uniform(0, min(JINA_BACKOFF_FACTOR * (2 ** (attempt - 1)), JINA_BACKOFF_MAX))
+
+def wait_jina_backoff(retry_state):
+    """tenacity 等待策略：读取上一次失败携带的 Retry-After"""
+    retry_after = getattr(retry_state.outcome.exception(), "retry_after", None)
+    return get_backoff_delay(retry_state.attempt_number, retry_after)
+
+def log_jina_retry(retry_state):
+    """每次重试前打印失败原因"""
+    print(f"   ⚠️ {retry_state.outcome.exception()}，稍后重试 (第 {retry_state.attempt_number} 次)")
+
+@retry(
+    wait=wait_jina_backoff,
+    stop=stop_after_attempt(JINA_MAX_RETRIES + 1),
+    retry=retry_if_exception_type((httpx.TransportError, RetryableFetchError)),
+    before_sleep=log_jina_retry,
+    reraise=True,
+)
+async def request_jina(session, jina_url):
+    """请求一次 Jina，仅在限流/服务端错误、网络异常或内容过短时由 tenacity 重试"""
+    resp = await session.get(jina_url)
+    if resp.status_code in JINA_RETRY_STATUSES:
+        raise RetryableFetchError(f"HTTP {resp.status_code}", resp.headers.get("Retry-After"))
+    if resp.status_code != 200:
+        raise httpx.HTTPStatusError(f"HTTP 错误 {resp.status_code}", request=resp.request, response=resp)
+
+    text = resp.text
+    # 简单的有效性检查
+    if len(text) < 200:
+        raise RetryableFetchError(f"内容过短 ({len(text)} 字符)")
+    return text
+
+async def read_jina_content(session, url):
     """
     使用 Jina 读取网页，伪装成浏览器以避免 GitHub Actions IP 被封
     """
+    cached = read_cache(url)
+    if cached is not None:
+        print(f"💾 命中本地缓存: {url}")
+        return cached
+
     print(f"🌐 正在请求 Jina 读取: {url}")
-    jina_url = f"https://r.jina.ai/{url}"
-    
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-        "Referer": "https://www.google.com/",
-        "X-Return-Format": "markdown"
-    }
+    try:
+        text = await request_jina(session, f"https://r.jina.ai/{url}")
+    except Exception as e:
+        print(f"   ❌ 读取失败: {url} ({e})")
+        return ""
 
-    for attempt in range(3):
-        try:
-            # 设置较长的超时时间
-            resp = requests.get(jina_url, headers=headers, timeout=40)
-            
-            if resp.status_code == 429:
-                print("   ⚠️ 触发速率限制，等待 10 秒...")
-                time.sleep(10)
-                continue
-            
-            if resp.status_code != 200:
-                print(f"   ❌ HTTP 错误 {resp.status_code}")
-                continue
+    write_cache(url, text)
+    return text
 
-            text = resp.text
-            # 简单的有效性检查
-            if len(text) < 200:
-                print(f"   ⚠️ 内容过短 ({len(text)} 字符)，可能是空页面或验证码。")
-                continue
-                
-            return text
-        except Exception as e:
-            print(f"   ❌ 请求异常 (第 {attempt+1} 次): {e}")
-            time.sleep(5)
-            
-    return ""
+async def fetch_jina_content(session, url):
+    """读取网页内容；同一次运行中重复或并发请求相同 URL 时只实际请求一次"""
+    task = inflight_fetches.get(url)
+    if task is None:
+        task = asyncio.ensure_future(read_jina_content(session, url))
+        inflight_fetches[url] = task
+    return await task
+
+def find_json_span(text, pos=0):
+    """
+    从 pos 开始单次扫描，定位第一对完整配对的顶层括号，返回 (start, end)。
+    通过括号深度计数找到与之匹配的闭合括号，跳过字符串内的括号；
+    未找到起始括号或括号未闭合（如输出被截断）时返回 None。
+    """
+    start = -1
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(pos, len(text)):
+        ch = text[i]
+        if start == -1:
+            if ch in "[{":
+                start = i
+                depth = 1
+            continue
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "[{":
+            depth += 1
+        elif ch in "]}":
+            depth -= 1
+            if depth == 0:
+                return start, i + 1
+    return None
+
+def is_json_payload(data):
+    """
+    判断解析结果是否符合提示词要求的结构：非空对象（{"content": ...} / {"items": [...]}），
+    或兼容直接返回的对象数组。
+    """
+    if isinstance(data, dict):
+        return bool(data)
+    return isinstance(data, list) and bool(data) and all(isinstance(x, dict) for x in data)
+
+def find_json_payload(text):
+    """
+    定位第一个能被成功解析、且结构符合 is_json_payload 的 JSON，返回 (start, end)。
+    说明文字中的括号会被跳过并继续向后查找：既包括“[8 条]”这类不合法的 JSON，
+    也包括“参考[1]”“{}”这类合法但不是结果的片段。
+    """
+    pos = 0
+    while True:
+        span = find_json_span(text, pos)
+        if span is None:
+            return None
+        try:
+            data = orjson.loads(text[span[0]:span[1]])
+        except orjson.JSONDecodeError:
+            # 不合法的片段内部可能嵌套着真正的结果，从起始括号之后继续查找
+            pos = span[0] + 1
+            continue
+        if is_json_payload(data):
+            return span
+        pos = span[1]
 
 def clean_json_string(text):
-    """清洗 AI 返回的 JSON 字符串"""
+    """
+    清洗 AI 返回的 JSON 字符串。
+    与流式结束条件使用同一规则（find_json_payload），前言中的“(见[1]”等括号不会被当作结果；
+    找不到完整结果时（如输出被截断）从第一个“{”开始保留，交给 repair_truncated_json 修复。
+    """
     if not text: return ""
     text = text.strip()
-    match = re.search(r'```(?:json)?\s*(.*?)\s*```', text, re.DOTALL | re.IGNORECASE)
-    if match: text = match.group(1).strip()
+
+    # 去掉包裹 JSON 的 markdown 代码块，定界符固定，直接用 str.find 定位
+    start = text.find("```")
+    if start != -1:
+        end = text.find("```", start + 3)
+        if end != -1:
+            inner = text[start + 3:end].lstrip()
+            if inner[:4].lower() == "json": inner = inner[4:]
+            text = inner.strip()
+
+    # 去掉 JSON 前后的说明文字
+    span = find_json_payload(text)
+    if span:
+        return text[span[0]:span[1]]
+    start = text.find("{")
+    if start > 0: text = text[start:]
+    return text
+
+def trim_to_boundary(text, min_keep=0.8):
+    """
+    将截断后的文本回退到最近的 Markdown 边界（段落、换行、句号等）。
+    只在末尾 1 - min_keep 的范围内查找，找不到合适边界时原样返回。
+    """
+    floor = int(len(text) * min_keep)
+    for sep in SPLIT_SEPARATORS:
+        pos = text.rfind(sep, floor)
+        if pos != -1:
+            # 换行/空格类分隔符在其之前断开，句末标点则保留
+            return text[:pos] if sep[0].isspace() else text[:pos + len(sep)]
     return text
 
-def get_latest_hot_news(all_markdown):
+def compress_markdown(md, drop_links=False):
+    """
+    去掉 Markdown 中对 AI 无用的空白，减少 token 消耗。
+    drop_links 时额外删除只含单个链接或图片的行（详情页的导航、推荐列表等）；
+    主页的新闻列表本身就是链接行，因此主页内容不能开启。
+    """
+    if drop_links:
+        md = LINK_LINE_RE.sub("", md)
+        md = IMAGE_LINE_RE.sub("", md)
+    md = TRAILING_SPACE_RE.sub("", md)
+    md = BLANK_LINES_RE.sub("\n\n", md)
+    return md.strip()
+
+@functools.lru_cache(maxsize=1)
+def get_encoder():
+    """
+    按需加载 tiktoken 编码器，用于按 token 精确截断内容，单次运行内只加载一次。
+    首次加载需要联网下载词表，失败时返回 None，不影响后续流程。
+    """
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"⚠️ 加载 tokenizer 失败，改为按字符估算截断: {e}")
+        return None
+
+def clip_to_tokens(text, max_tokens):
+    """将文本截断到不超过 max_tokens 个 token，并尽量在 Markdown 边界处断开"""
+    enc = get_encoder()
+    if enc is None:
+        max_chars = int(max_tokens * FALLBACK_CHARS_PER_TOKEN)
+        return text if len(text) <= max_chars else trim_to_boundary(text[:max_chars])
+    ids = enc.encode(text)
+    if len(ids) <= max_tokens:
+        return text
+    return trim_to_boundary(enc.decode(ids[:max_tokens]))
+
+def build_segmented_context(segments, max_tokens):
+    """
+    将多个来源的内容合并为一条消息，每段以 <<<SEG i/n>>> 标记分隔。
+    token 预算在各段之间平分，避免排在最前面的来源占满全部上下文。
+    """
+    n = len(segments)
+    per_segment = max_tokens // max(n, 1)
+    return "\n".join([
+        SEGMENT_TMPL.format(i=i + 1, n=n, chunk=clip_to_tokens(compress_markdown(seg), per_segment))
+        for i, seg in enumerate(segments)
+    ])
+
+def is_json_mode_unsupported(error):
+    """判断 400 错误是否由模型不支持 response_format（JSON 模式）引起，其他错误（如上下文超长）不算"""
+    if getattr(error, "param", None) == "response_format":
+        return True
+    detail = f"{getattr(error, 'body', '')} {error}".lower()
+    return "response_format" in detail or "json mode" in detail or "json_object" in detail
+
+async def create_completion(**kwargs):
+    """
+    以流式方式调用模型并返回输出文本。
+    一旦收到结构符合要求的完整 JSON 结果就停止接收，模型后续追加的说明文字直接丢弃；
+    前言中的括号（如“共 [8 条]”“参考[1]”）不会触发提前结束。
+    同时检查 OpenRouter 返回的限流响应头，剩余额度耗尽时在释放并发名额前等待到额度重置，
+    避免后续请求直接触发 429。
+    """
+    raw = await client.chat.completions.with_raw_response.create(**kwargs, stream=True)
+    stream = raw.parse()
+    parts = []
+    try:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            parts.append(delta)
+            # 只有出现闭合括号时才可能结束，避免每个片段都重新扫描
+            if ("]" in delta or "}" in delta) and find_json_payload("".join(parts)):
+                break
+    finally:
+        await stream.close()
+
+    remaining = raw.headers.get("x-ratelimit-remaining", "")
+    if remaining.isdigit() and int(remaining) == 0:
+        reset = raw.headers.get("x-ratelimit-reset", "")
+        # 重置时间为毫秒级时间戳
+        wait = int(reset) / 1000 - time.time() if reset.isdigit() else 1
+        wait = min(max(wait, 0), 60)
+        print(f"   ⚠️ AI 请求额度已用尽，等待 {wait:.1f} 秒后继续...")
+        await asyncio.sleep(wait)
+    return "".join(parts)
+
+@retry(
+    wait=wait_random_exponential(multiplier=1, max=60),
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception_type(RateLimitError),
+    reraise=True,
+)
+async def call_ai(prompt, max_tokens, system=None):
+    """
+    发送单轮对话请求并返回模型输出的文本，遇到 429 限流时指数退避重试。
+    system 为固定指令时放在 system 消息中，prompt 只包含本次变化的内容。
+    优先使用 JSON 模式；模型不支持时退回普通输出，由 clean_json_string 清洗。
+    """
+    global json_mode_supported
+    messages = [{"role": "user", "content": prompt}]
+    if system:
+        messages.insert(0, {"role": "system", "content": system})
+    kwargs = {
+        "model": AI_MODEL,
+        "messages": messages,
+        "temperature": 0, # 零温度保证输出稳定
+        "max_tokens": max_tokens,
+    }
+    async with ai_semaphore:
+        if json_mode_supported:
+            try:
+                return await create_completion(**kwargs, response_format={"type": "json_object"})
+            except BadRequestError as e:
+                if not is_json_mode_unsupported(e):
+                    raise
+                print(f"   ⚠️ 模型不支持 JSON 模式，改用普通输出: {e}")
+                json_mode_supported = False
+        return await create_completion(**kwargs)
+
+def repair_truncated_json(text):
+    """
+    修复因 max_tokens 截断而未闭合的列表结果（{"items": [...]} 或 [...]）：
+    丢弃最后一个不完整的条目后补全括号，无法修复时返回 None。
+    """
+    text = text.strip()
+    if text.startswith("{"):
+        closing = "]}"
+    elif text.startswith("["):
+        closing = "]"
+    else:
+        return None
+    end = text.rfind("}")
+    while end > 0:
+        try:
+            return orjson.loads(text[:end + 1] + closing)
+        except orjson.JSONDecodeError:
+            end = text.rfind("}", 0, end)
+    return None
+
+def unwrap_items(data):
+    """JSON 模式下顶层必须是对象，列表结果包裹在 items 字段中；兼容直接返回数组的情况"""
+    if isinstance(data, dict):
+        return data.get("items", [])
+    return data
+
+def normalize_url(url):
+    """
+    规范化 URL，仅用作去重的键：域名小写、去掉锚点和 utm_* 跟踪参数。
+    其余查询参数原样保留、不重新编码；实际抓取和保存的仍是原始 URL。
+    """
+    parts = urlsplit(url.strip())
+    query = "&".join(p for p in parts.query.split("&") if p and not p.lower().startswith("utm_"))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ""))
+
+def dedupe_news(news_list):
+    """按规范化后的 URL 去重，保留首次出现的条目，避免同一篇文章被重复抓取和分析"""
+    seen = set()
+    unique = []
+    for news in news_list:
+        key = normalize_url(news["url"])
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(news)
+    return unique
+
+def get_site_domain(url):
+    """取 URL 的主机名并去掉 www. 前缀，如 https://www.ithome.com -> ithome.com"""
+    host = urlsplit(url).netloc.lower()
+    return host[4:] if host.startswith("www.") else host
+
+def is_article_link(url, site):
+    """判断链接是否为来源站点自己的文章页：域名属于该站点（含子域名），且路径符合已知的文章格式"""
+    domain = get_site_domain(site)
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    if host != domain and not host.endswith("." + domain):
+        return False
+    pattern = ARTICLE_PATH_RES.get(domain)
+    return pattern is None or bool(pattern.match(parts.path))
+
+def extract_hot_news_locally(home_pages):
+    """
+    直接从主页 Markdown 中解析新闻链接，按关键词筛选硬件科技新闻。
+    home_pages 为 [(来源网址, Markdown)] 列表，只保留指向该来源自身文章页的链接。
+    主页列表按发布时间排列，因此按出现顺序取前 NEWS_LIMIT 条。
+    """
+    keywords = [k.lower() for k in HARDWARE_KEYWORDS]
+    seen = set()
+    news = []
+    for site, text in home_pages:
+        for title, url in LINK_RE.findall(text):
+            title = title.strip()
+            key = normalize_url(url)
+            if key in seen or not is_article_link(url, site):
+                continue
+            lowered = title.lower()
+            if not any(k in lowered for k in keywords):
+                continue
+            seen.add(key)
+            news.append({"title": title, "url": url})
+    return news[:NEWS_LIMIT]
+
+async def get_latest_hot_news(home_pages):
     """
-    使用 AI 提取【当日】热点新闻
+    使用 AI 提取【当日】热点新闻，所有来源合并为一次请求。
+    home_pages 为 [(来源网址, Markdown)] 列表，相对链接按 AI 返回的内容段编号对应的来源补全。
     """
     today_date = get_beijing_date()
     print(f"🧠 正在请求 AI ({AI_MODEL}) 提取 {today_date} 的新闻...")
     
-    # 截取前 20000 字符，step-3.5-flash 处理长文本能力尚可
-    context = all_markdown[:20000]
-    
-    # 提示词要求 8 条
-    prompt = f"""
-    今天是北京时间：{today_date}。
-    
-    请分析以下网页内容，严格筛选出【今天 ({today_date})】发布的、最热门的 8 条【硬件科技产品】新闻（手机、电脑、芯片、数码等）。
+    # 按 token 预算截取，既不溢出上下文也不浪费空间
+    sites = [site for site, _ in home_pages]
+    home_segments = [f"=== 来源: {site} ===\n{text}" for site, text in home_pages]
+    context = build_segmented_context(home_segments, HOME_TOKEN_BUDGET)
     
-    如果不确定日期，请优先选择列表中最靠前的新闻。
-    
-    请严格返回 JSON 数组格式，不要包含任何 markdown 标记或额外文字：
-    [
-        {{"title": "新闻标题", "url": "链接地址"}}
-    ]
-    
-    内容来源：
-    {context}
-    """
+    # 提示词要求 NEWS_LIMIT 条
+    prompt = HOT_NEWS_PROMPT_TMPL.format(date=today_date, limit=NEWS_LIMIT, context=context)
     
     try:
-        resp = client.chat.completions.create(
-            model=AI_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.1 # 低温度保证准确性
-        )
-        content = resp.choices[0].message.content
+        content = await call_ai(prompt, LIST_MAX_TOKENS)
         cleaned_content = clean_json_string(content)
         
         try:
-            data = json.loads(cleaned_content)
-        except json.JSONDecodeError:
-            # 尝试修复常见的 JSON 错误（如未闭合）
-            if cleaned_content.strip().startswith("[") and not cleaned_content.strip().endswith("]"):
-                 cleaned_content += "]"
-                 data = json.loads(cleaned_content)
-            else:
+            data = orjson.loads(cleaned_content)
+        except orjson.JSONDecodeError:
+            # 尝试修复常见的 JSON 错误（如输出被截断未闭合）
+            data = repair_truncated_json(cleaned_content)
+            if data is None:
                 print(f"❌ JSON 解析失败，AI 返回: {content}")
                 return []
 
         # 链接补全与清洗
         valid_data = []
-        for item in data:
+        for item in unwrap_items(data):
             u = item.get("url", "")
             t = item.get("title", "")
             if not u: continue
             
-            # 自动补全相对路径
-            if u.startswith("/"):
-                # 简单判断来源
-                if "ithome" in all_markdown and "mydrivers" not in u:
-                    u = urljoin("https://www.ithome.com", u)
-                else:
-                    u = urljoin("https://www.mydrivers.com", u)
+            # 自动补全相对路径：seg 从 1 开始编号，缺失或越界时按第一个来源补全
+            if not u.startswith(("http://", "https://")):
+                seg = item.get("seg")
+                site = sites[seg - 1] if isinstance(seg, int) and 1 <= seg <= len(sites) else sites[0]
+                u = urljoin(site.rstrip("/") + "/", u)
             
             valid_data.append({"title": t, "url": u})
             
-        # 返回前 8 条
-        return valid_data[:8]
+        # 返回前 NEWS_LIMIT 条
+        return valid_data[:NEWS_LIMIT]
 
     except Exception as e:
         print(f"❌ AI 提取列表报错: {e}")
         return []
 
-def get_article_details(title, url):
-    """提取单篇新闻详情"""
+def extract_images(md, limit=3):
+    """直接从详情页 Markdown 中按出现顺序提取图片链接，无需交给 AI"""
+    return IMG_RE.findall(md)[:limit]
+
+async def get_article_details(title, md):
+    """根据已抓取的详情页 Markdown 提取单篇新闻详情"""
     print(f"  -> 分析详情: {title}")
     
-    # 强制休眠，防止并发请求导致 Jina 封锁
-    time.sleep(3)
-    
-    md = fetch_jina_content(url)
     if not md:
         print("     (跳过：未获取到详情页内容)")
         return None
-        
-    prompt = f"""
-    请阅读这篇科技新闻，提取核心内容总结（300字以内）和第一张产品图片的链接。
-    
-    文章内容：
-    {md[:10000]}
-    
-    请严格返回 JSON 格式：
-    {{
-        "content": "这里是总结...",
-        "images": ["图片URL"]
-    }}
-    """
-    
+
     try:
-        resp = client.chat.completions.create(
-            model=AI_MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.1
-        )
-        return json.loads(clean_json_string(resp.choices[0].message.content))
+        article_text = clip_to_tokens(compress_markdown(md, drop_links=True), ARTICLE_TOKEN_BUDGET)
+        content = await call_ai(article_text, DETAIL_MAX_TOKENS, system=DETAIL_SYSTEM_PROMPT)
+        data = orjson.loads(clean_json_string(content))
+        return {"content": data.get("content", ""), "images": extract_images(md)}
     except Exception as e:
         print(f"     (详情提取失败: {e})")
         return {"content": "内容提取失败", "images": []}
 
-def main():
-    # 1. 启动时的兜底措施
-    if not OPENROUTER_API_KEY:
-        print("❌ 致命错误: 未配置 OPENROUTER_API_KEY")
-        return 
+async def analyze_article_batch(batch, articles, results):
+    """
+    一次 AI 请求分析一批文章，结果按 idx 写回 results。
+    每篇的输入预算按批大小计算，保证输入加回复上限不超出模型上下文。
+    """
+    per_article = min(
+        ARTICLE_TOKEN_BUDGET,
+        (MODEL_CONTEXT_TOKENS - PROMPT_RESERVE_TOKENS) // len(batch) - DETAIL_MAX_TOKENS
+    )
+    batch_ids = {i for i, _ in batch}
+    articles_text = "".join([
+        ARTICLE_TMPL.format(i=i, chunk=clip_to_tokens(compress_markdown(article["md"], drop_links=True), per_article))
+        for i, article in batch
+    ])
 
-    # 2. 抓取所有来源的主页
-    full_home_content = ""
-    for site in SOURCES:
-        text = fetch_jina_content(site)
-        print(f"   [{site}] 获取长度: {len(text)}")
-        if len(text) > 500:
-            full_home_content += f"\n=== 来源: {site} ===\n{text}\n"
-        time.sleep(2)
-
-    if not full_home_content:
-        print("❌ 所有来源抓取失败，无法进行后续分析。")
-        print("⚠️ 终止更新，保留原有数据。")
-        return
+    try:
+        content = await call_ai(articles_text, DETAIL_MAX_TOKENS * len(batch), system=BATCH_DETAIL_SYSTEM_PROMPT)
+        data = orjson.loads(clean_json_string(content))
+        for item in unwrap_items(data):
+            idx = item.get("idx")
+            if idx in batch_ids:
+                results[idx] = {"content": item.get("content", ""), "images": extract_images(articles[idx]["md"])}
+    except Exception as e:
+        print(f"   ⚠️ 批量详情提取失败: {e}")
 
-    # 3. 提取今日热点
-    news_list = get_latest_hot_news(full_home_content)
-    print(f"✅ 提取到 {len(news_list)} 条今日新闻")
+async def get_all_article_details(articles):
+    """
+    批量提取多篇新闻详情：文章按 BATCH_MAX_ARTICLES 分批，每批一次 AI 请求，各批并发进行。
+    articles 为 [{"title": ..., "md": ...}] 列表，返回与之等长的列表，
+    未获取到内容或批量结果中缺失的条目为 None。
+    """
+    results = [None] * len(articles)
+    indexed = []
+    for i, article in enumerate(articles):
+        if article["md"]:
+            indexed.append((i, article))
+        else:
+            print(f"  -> 跳过（未获取到详情页内容）: {article['title']}")
+    if not indexed:
+        return results
 
-    if not news_list:
-        print("⚠️ 未提取到有效新闻，可能是因为今天还没有更新或 AI 解析失败。")
-        print("⚠️ 终止更新，保留原有数据。")
-        return
+    batches = [indexed[i:i + BATCH_MAX_ARTICLES] for i in range(0, len(indexed), BATCH_MAX_ARTICLES)]
+    print(f"🧠 正在分 {len(batches)} 批分析 {len(indexed)} 篇新闻详情...")
+    await asyncio.gather(*[analyze_article_batch(batch, articles, results) for batch in batches])
+    return results
 
-    # 4. 循环提取详情
+async def fetch_all(session, urls, limit=None):
+    """
+    并发抓取多个页面，结果顺序与 urls 保持一致；limit 用于限制同时进行的请求数。
+    单个页面抛出意外异常时记为空内容，不影响其他页面。
+    """
+    semaphore = asyncio.Semaphore(limit or len(urls) or 1)
+
+    async def fetch_limited(url):
+        async with semaphore:
+            return await fetch_jina_content(session, url)
+
+    results = await asyncio.gather(*[fetch_limited(u) for u in urls], return_exceptions=True)
+    texts = []
+    for url, result in zip(urls, results):
+        if isinstance(result, Exception):
+            print(f"   ❌ 抓取异常: {url} ({result})")
+            result = ""
+        texts.append(result)
+    return texts
+
+def build_final_result(news_list, details_list, verbose=False):
+    """按新闻顺序整理有效的详情结果，跳过失败或内容无效的条目；verbose 时打印跳过原因"""
     final_result = []
-    for news in news_list:
-        details = get_article_details(news["title"], news["url"])
-        
+    for news, details in zip(news_list, details_list):
+        if isinstance(details, Exception):
+            if verbose:
+                print(f"   ⚠️ 详情分析异常，跳过: {news['title']} ({details})")
+            continue
+
         if details:
             content = details.get("content", "")
             
             # 【关键修改点】：如果内容是“内容提取失败”或为空，则跳过该条新闻
             if content == "内容提取失败" or not content:
-                print(f"   ⚠️ 内容无效，跳过: {news['title']}")
+                if verbose:
+                    print(f"   ⚠️ 内容无效，跳过: {news['title']}")
                 continue
 
             final_result.append({
@@ -257,19 +806,88 @@ def main():
                 "内容": content,
                 "配图": details.get("images", [])
             })
+    return final_result
 
-    # 5. 保存结果
+def flush_results(news_list, details_list):
+    """将目前已完成的有效结果落盘，中途崩溃时不会丢失已完成的条目；没有有效结果时保留原有数据"""
+    final_result = build_final_result(news_list, details_list)
     if final_result:
         save_json_file(final_result)
+
+async def main():
+    # 1. 启动时的兜底措施
+    if not OPENROUTER_API_KEY:
+        print("❌ 致命错误: 未配置 OPENROUTER_API_KEY")
+        return 
+
+    # 整个运行过程共用一个会话，复用底层连接
+    async with create_session() as session:
+        # 2. 并发抓取所有来源的主页
+        home_texts = await fetch_all(session, SOURCES)
+
+        home_pages = []
+        for site, text in zip(SOURCES, home_texts):
+            print(f"   [{site}] 获取长度: {len(text)}")
+            if len(text) > 500:
+                home_pages.append((site, text))
+
+        if not home_pages:
+            print("❌ 所有来源抓取失败，无法进行后续分析。")
+            print("⚠️ 终止更新，保留原有数据。")
+            return
+
+        # 3. 提取今日热点：优先本地解析链接，数量不足时再交给 AI 判断
+        news_list = extract_hot_news_locally(home_pages)
+        print(f"🔎 本地解析到 {len(news_list)} 条硬件新闻")
+        if len(news_list) < LOCAL_NEWS_MIN:
+            # AI 提取失败时仍保留本地解析到的结果
+            news_list = await get_latest_hot_news(home_pages) or news_list
+        news_list = dedupe_news(news_list)
+        print(f"✅ 提取到 {len(news_list)} 条今日新闻")
+
+        if not news_list:
+            print("⚠️ 未提取到有效新闻，可能是因为今天还没有更新或 AI 解析失败。")
+            print("⚠️ 终止更新，保留原有数据。")
+            return
+
+        # 4. 并发抓取所有详情页（限制并发数，防止被 Jina 封锁）
+        article_mds = await fetch_all(session, [n["url"] for n in news_list], limit=JINA_CONCURRENCY)
+
+    # 5. 一次请求批量提取所有详情，批量结果中缺失的条目再逐条并发补充
+    details_list = await get_all_article_details(
+        [{"title": n["title"], "md": md} for n, md in zip(news_list, article_mds)]
+    )
+    flush_results(news_list, details_list)
+
+    missing = [i for i, d in enumerate(details_list) if d is None and article_mds[i]]
+    if missing:
+        print(f"   ⚠️ 批量结果缺少 {len(missing)} 条，逐条补充提取...")
+
+        async def retry_one(i):
+            try:
+                return i, await get_article_details(news_list[i]["title"], article_mds[i])
+            except Exception as e:
+                return i, e
+
+        # 每补充完成一条就立即落盘
+        for future in asyncio.as_completed([retry_one(i) for i in missing]):
+            i, details = await future
+            details_list[i] = details
+            flush_results(news_list, details_list)
+
+    # 6. 汇总结果（有效结果已在上面逐步保存）
+    final_result = build_final_result(news_list, details_list, verbose=True)
+    if final_result:
+        print(f"✅ 共保存 {len(final_result)} 条新闻")
         # 打印结果供日志检查
-        print(json.dumps(final_result, ensure_ascii=False, indent=2))
+        print(orjson.dumps(final_result, option=orjson.OPT_INDENT_2).decode("utf-8"))
     else:
         print("❌ 所有详情分析均失败或无效。")
         print("⚠️ 终止更新，保留原有数据。")
 
 if __name__ == "__main__":
     try:
-        main()
+        asyncio.run(main())
     except Exception as e:
         print(f"💥 脚本发生未捕获异常退出: {e}")
         print("⚠️ 终止更新，保留原有数据。")